@@ -1,6 +1,8 @@
 import { type NextRequest, NextResponse } from "next/server"
 import { exec } from "child_process"
 import { promisify } from "util"
+import { createReadStream } from "fs"
+import { Readable } from "stream"
 import fs from "fs/promises"
 import path from "path"
 import os from "os"
@@ -29,25 +31,26 @@ function sanitizeFilename(filename: string): string {
     || 'processed_pdf' // Fallback if filename becomes empty
 }
 
+type PythonResult = { success: boolean; outputPath?: string; outputSize?: number; pageCount?: number; error?: string }
+
 // Function to process PDF using Python via subprocess
+// On success the output PDF is left on disk so it can be streamed to the client
 async function processPDFWithPythonSubprocess(
   inputBuffer: ArrayBuffer, 
   mode: string
-): Promise<{ success: boolean; outputBuffer?: Buffer; pageCount?: number; error?: string }> {
+): Promise<PythonResult> {
+  // Create temporary files
+  const tempDir = os.tmpdir()
+  const inputPath = path.join(tempDir, `input_${Date.now()}.pdf`)
+  const outputPath = path.join(tempDir, `output_${Date.now()}.pdf`)
+
   try {
-    // Create temporary files
-    const tempDir = os.tmpdir()
-    const inputPath = path.join(tempDir, `input_${Date.now()}.pdf`)
-    const outputPath = path.join(tempDir, `output_${Date.now()}.pdf`)
-    
     // Write input buffer to temporary file
     await fs.writeFile(inputPath, Buffer.from(inputBuffer))
     
-    // Run Python script directly
+    // Run Python script directly; it lowers the DPI itself for large documents
     const pythonScript = path.join(process.cwd(), 'pdf_inverter.py')
-    const isLargeFile = inputBuffer.byteLength > 10 * 1024 * 1024 // 10MB
-    const dpi = isLargeFile ? 200 : 300 // Lower DPI for large files
-    const command = `python "${pythonScript}" "${inputPath}" "${outputPath}" --dpi ${dpi} --mode ${mode}`
+    const command = `python "${pythonScript}" "${inputPath}" "${outputPath}" --mode ${mode}`
     
     const { stdout, stderr } = await execAsync(command)
     
@@ -55,21 +58,22 @@ async function processPDFWithPythonSubprocess(
       console.warn('Python script stderr:', stderr)
     }
     
-    // Read the output file
-    const outputBuffer = await fs.readFile(outputPath)
+    // Only the size is needed here; the file itself is streamed later
+    const { size: outputSize } = await fs.stat(outputPath)
     
-    // Clean up temporary files
+    // Clean up the input file
     await fs.unlink(inputPath).catch(() => {})
-    await fs.unlink(outputPath).catch(() => {})
     
     // Extract page count from stdout
     const pageCountMatch = stdout.match(/Converted (\d+) pages to images/)
     const pageCount = pageCountMatch ? parseInt(pageCountMatch[1]) : 0
     
-    return { success: true, outputBuffer, pageCount }
+    return { success: true, outputPath, outputSize, pageCount }
     
   } catch (error) {
     console.error('Python subprocess error:', error)
+    await fs.unlink(inputPath).catch(() => {})
+    await fs.unlink(outputPath).catch(() => {})
     return { 
       success: false, 
       error: error instanceof Error ? error.message : 'Unknown Python subprocess error' 
@@ -116,7 +120,7 @@ export async function POST(request: NextRequest) {
     const startTime = Date.now()
 
     // Process PDF using Python only
-    let pythonResult: { success: boolean; outputBuffer?: Buffer; pageCount?: number; error?: string }
+    let pythonResult: PythonResult
     
     try {
       // Use Python subprocess (works in both local and serverless)
@@ -146,15 +150,24 @@ export async function POST(request: NextRequest) {
     const sanitizedFilename = sanitizeFilename(originalName)
     const outputFilename = `${sanitizedFilename}_dark_mode.pdf`
 
-    return new NextResponse(pythonResult.outputBuffer, {
+    // Stream the output from disk in chunks instead of buffering the whole
+    // file, and remove it once the stream is done
+    const outputPath = pythonResult.outputPath!
+    const outputSize = pythonResult.outputSize!
+    const outputStream = createReadStream(outputPath)
+    outputStream.on("close", () => {
+      fs.unlink(outputPath).catch(() => {})
+    })
+
+    return new NextResponse(Readable.toWeb(outputStream) as ReadableStream<Uint8Array>, {
       status: 200,
       headers: {
         "Content-Type": "application/pdf",
         "Content-Disposition": `attachment; filename="${outputFilename}"`,
-        "Content-Length": pythonResult.outputBuffer!.length.toString(),
+        "Content-Length": outputSize.toString(),
         "X-Original-Filename": sanitizeFilename(file.name),
         "X-Original-Size": pdfBytes.byteLength.toString(),
-        "X-Output-Size": pythonResult.outputBuffer!.length.toString(),
+        "X-Output-Size": outputSize.toString(),
         "X-Pages-Processed": pageCount.toString(),
         "X-Processing-Time": processingTime.toString(),
         "X-Processing-Errors": "0",
@@ -0,0 +1,55 @@
+/*
+ * Byte inversion (x -> 255 - x) for pdf_inverter.py.
+ *
+ * Build next to pdf_inverter.py, which loads it through ctypes if present:
+ *
+ *     gcc -O3 -shared -fPIC -o invert_avx2.so invert_avx2.c
+ *
+ * The AVX2 loop is compiled through a target attribute and only used when
+ * the CPU reports AVX2 support, so the library is safe to load anywhere.
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define HAVE_AVX2_PATH 1
+#include <immintrin.h>
+
+/* XOR with all ones, 64 bytes per iteration; returns bytes processed. */
+__attribute__((target("avx2")))
+static size_t invert_avx2(const uint8_t *src, uint8_t *dst, size_t n)
+{
+    const __m256i ones = _mm256_set1_epi8(-1);
+    size_t i = 0;
+
+    for (; i + 64 <= n; i += 64) {
+        __m256i a = _mm256_loadu_si256((const __m256i *)(src + i));
+        __m256i b = _mm256_loadu_si256((const __m256i *)(src + i + 32));
+        _mm256_storeu_si256((__m256i *)(dst + i), _mm256_xor_si256(a, ones));
+        _mm256_storeu_si256((__m256i *)(dst + i + 32), _mm256_xor_si256(b, ones));
+    }
+
+    for (; i + 32 <= n; i += 32) {
+        __m256i v = _mm256_loadu_si256((const __m256i *)(src + i));
+        _mm256_storeu_si256((__m256i *)(dst + i), _mm256_xor_si256(v, ones));
+    }
+
+    return i;
+}
+#endif
+
+/* Write the inverse of src into dst; the two may be the same buffer. */
+void invert_copy(const uint8_t *src, uint8_t *dst, size_t n)
+{
+    size_t i = 0;
+
+#ifdef HAVE_AVX2_PATH
+    if (__builtin_cpu_supports("avx2"))
+        i = invert_avx2(src, dst, n);
+#endif
+
+    /* Scalar tail, or the whole buffer without AVX2 */
+    for (; i < n; i++)
+        dst[i] = (uint8_t)~src[i];
+}
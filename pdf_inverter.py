@@ -13,9 +13,14 @@ This approach provides true color inversion rather than just overlays.
 
 import sys
 import os
+import io
 import json
+import ctypes
+import functools
 from pathlib import Path
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Set UTF-8 encoding for Windows compatibility
 if sys.platform.startswith('win'):
@@ -25,7 +30,7 @@ if sys.platform.startswith('win'):
 
 try:
     import fitz  # PyMuPDF
-    from PIL import Image, ImageOps
+    from PIL import Image
     import numpy as np
 except ImportError as e:
     print(f"Missing required library: {e}")
@@ -33,6 +38,96 @@ except ImportError as e:
     print("pip install PyMuPDF Pillow numpy")
     sys.exit(1)
 
+# Optional: SIMD byte inversion built from invert_avx2.c (see build notes there)
+try:
+    _invert_lib = ctypes.CDLL(str(Path(__file__).with_name("invert_avx2.so")))
+    _invert_lib.invert_copy.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+    _invert_lib.invert_copy.restype = None
+except (OSError, AttributeError):
+    # Missing library, or a stale build without invert_copy
+    _invert_lib = None
+
+
+# Upper bound on worker processes for page rendering; more workers than
+# this stops paying off and starts to slow things down again
+MAX_WORKERS = 6
+
+# Rendering budget across the whole document, in pixels; the DPI is lowered
+# for long or large-format documents so the total stays under this
+MAX_TOTAL_PIXELS = 50_000_000
+
+# Never lower the DPI below this, to keep text legible
+MIN_ADAPTIVE_DPI = 120
+
+# JPEG quality of the embedded page images per mode; the soft grays of
+# printing mode hold up to stronger compression
+JPEG_QUALITY = {"reading": 85, "printing": 75, "presentation": 85}
+
+# Largest channel difference still treated as gray when checking for color
+GRAY_TOLERANCE = 4
+
+# Only every Nth row and column is checked for color, to keep the check
+# cheap next to rendering
+GRAY_SAMPLE_STEP = 4
+
+# PIL image mode for each pixmap channel count
+PIXMAP_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+# Lookup tables for the per-pixel inversion modes, built once at import from
+# the plain 255 - x mapping so each page is a single gather with no
+# full-image temporaries
+_INVERTED = 255 - np.arange(256, dtype=np.float64)
+# Printing is a pure per-channel map, applied with PIL's Image.point
+_LUT_PRINTING = bytes(np.clip(_INVERTED * 0.7 + 255 * 0.3, 0, 255).astype(np.uint8))
+# Rows: regular pixels, light pixels (darkened), dark pixels (lightened)
+_LUT_PRESENTATION = np.clip(
+    np.stack([_INVERTED, _INVERTED * 0.8, _INVERTED + 30]), 0, 255
+).astype(np.uint8)
+
+
+def _invert_presentation(arr, out):
+    """Presentation-mode inversion of an RGB array in a single pass."""
+    for i in range(arr.shape[0]):
+        for j in range(arr.shape[1]):
+            r = 255 - arr[i, j, 0]
+            g = 255 - arr[i, j, 1]
+            b = 255 - arr[i, j, 2]
+            
+            # Darken very light pixels, lighten very dark ones
+            if r > 200 and g > 200 and b > 200:
+                r = int(r * 0.8)
+                g = int(g * 0.8)
+                b = int(b * 0.8)
+            elif r < 55 and g < 55 and b < 55:
+                r += 30
+                g += 30
+                b += 30
+            
+            out[i, j, 0] = r
+            out[i, j, 1] = g
+            out[i, j, 2] = b
+
+
+@functools.lru_cache(maxsize=None)
+def _presentation_kernel():
+    """
+    Compile _invert_presentation with Numba on first use.
+    
+    Numba is optional and slow to import, so it is only loaded once a
+    presentation-mode page actually needs it.
+    
+    Returns:
+        callable: The compiled kernel, or None if Numba is not installed
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    
+    # Serial on purpose: pages are already spread over worker processes, and
+    # Numba's threading layers are not safe to use across fork
+    return njit(fastmath=True, cache=True)(_invert_presentation)
+
 
 class TruePDFColorInverter:
     """
@@ -52,69 +147,213 @@ class TruePDFColorInverter:
         """
         self.dpi = dpi
         self.optimize_large_files = optimize_large_files
-        self.temp_dir = Path("temp_images")
-        self.temp_dir.mkdir(exist_ok=True)
+        
+        # DPI actually used for the current document; may be lower than the
+        # configured one, and is picked again for every document
+        self.render_dpi = dpi
+        
+        # Page-sized buffer reused for every page of the same size, so pages
+        # don't each pay for a fresh allocation and its first-touch faults
+        self._scratch = None
     
-    def pdf_to_images(self, pdf_path):
+    def adaptive_dpi(self, doc):
         """
-        Convert PDF pages to high-resolution images.
+        Pick a rendering DPI that keeps the total pixel count bounded.
         
         Args:
-            pdf_path (str): Path to the input PDF file
+            doc (fitz.Document): Open input document
             
         Returns:
-            list: List of PIL Image objects, one per page
+            int: The configured DPI, lowered for long or large-format documents
+        """
+        # Largest page area in points; pixels per page = area * (dpi / 72)^2
+        max_area = max(page.rect.width * page.rect.height for page in doc)
+        budget_dpi = int((MAX_TOTAL_PIXELS / (len(doc) * max_area)) ** 0.5 * 72)
+        
+        return min(self.dpi, max(MIN_ADAPTIVE_DPI, budget_dpi))
+    
+    def is_grayscale(self, pix):
+        """
+        Check whether a rendered RGB page has no color.
+        
+        Only a strided subset of pixels is sampled (see GRAY_SAMPLE_STEP).
+        
+        Args:
+            pix (fitz.Pixmap): Rendered RGB page
+            
+        Returns:
+            bool: True if no sampled pixel's channels differ by GRAY_TOLERANCE
+                or more
+        """
+        step = GRAY_SAMPLE_STEP
+        samples = self.pixmap_array(pix)[::step, ::step].astype(np.int16)
+        r, g, b = samples[..., 0], samples[..., 1], samples[..., 2]
+        
+        # Per-channel differences; stop at the first pair showing color
+        for x, y in ((r, g), (g, b), (r, b)):
+            if np.abs(x - y).max() >= GRAY_TOLERANCE:
+                return False
+        return True
+    
+    def iter_inverted_pages(self, doc, source, mode="reading"):
         """
-        print(f"Converting PDF to images at {self.dpi} DPI...")
+        Render and invert PDF pages, yielding them one at a time in order.
         
-        doc = fitz.open(pdf_path)
-        images = []
+        Pages are processed in worker processes, with only a couple of pages
+        per worker in flight at once, so memory use is bounded by the number
+        of workers rather than the number of pages. Single-page documents
+        (or single-core machines) are rendered from the already open document.
         
-        for page_num in range(len(doc)):
-            print(f"Processing page {page_num + 1}/{len(doc)}")
+        Args:
+            doc (fitz.Document): Open input document
+            source (str): Path to the input PDF, for worker processes to open
+            mode (str): Processing mode - "reading", "printing", or "presentation"
             
-            # Get page
-            page = doc.load_page(page_num)
+        Yields:
+            tuple: (pixel_bytes, image_mode, width, height) for each inverted page
+        """
+        page_count = len(doc)
+        workers = min(_available_cpus(), MAX_WORKERS, page_count)
+        print(f"Converting PDF to images at {self.render_dpi} DPI...")
+        
+        # Each worker opens the document once and reuses it for all its pages
+        executor = None
+        if workers > 1:
+            try:
+                executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=(source, self.render_dpi),
+                )
+            except OSError as e:
+                # e.g. no /dev/shm for the pool's locks in some sandboxes
+                print(f"Warning: Could not start worker processes: {e}")
+                workers = 1
+        
+        print(f"Rendering and inverting {page_count} pages with {workers} worker(s)...")
+        
+        if executor is None:
+            for page in doc:
+                inverted = self.invert_page(self.render_page(page), mode)
+                yield inverted.tobytes(), inverted.mode, inverted.width, inverted.height
+            return
+        
+        with executor:
+            pending = deque()
             
-            # Create matrix for high-resolution rendering
-            # Higher DPI = better quality but larger file size
-            zoom = self.dpi / 72.0  # 72 DPI is default
-            mat = fitz.Matrix(zoom, zoom)
+            for page_idx in range(page_count):
+                pending.append(executor.submit(_render_and_invert, page_idx, mode))
+                
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
             
-            # Render page to pixmap
-            pix = page.get_pixmap(matrix=mat)
+            while pending:
+                yield pending.popleft().result()
+    
+    def render_page(self, page):
+        """
+        Render a single PDF page to a pixmap at the current render DPI.
+        
+        Pages without any color are collapsed to 1-channel gray, a third of
+        the pixel data of RGB through every later step.
+        
+        Args:
+            page (fitz.Page): Page to render
+            
+        Returns:
+            fitz.Pixmap: Rendered page, RGB or gray
+        """
+        # Render page straight to 8-bit RGB without an alpha channel, so the
+        # samples can be handed to numpy/PIL as-is
+        # Higher DPI = better quality but larger file size
+        pix = page.get_pixmap(
+            dpi=self.render_dpi, colorspace=fitz.csRGB, alpha=False, annots=True
+        )
+        
+        if self.is_grayscale(pix):
+            pix = fitz.Pixmap(fitz.csGRAY, pix)
+        return pix
+    
+    def pixmap_to_image(self, pix):
+        """
+        Wrap a rendered pixmap in a PIL Image.
+        
+        Args:
+            pix (fitz.Pixmap): Rendered page
             
-            # Convert to PIL Image
-            img_data = pix.tobytes("ppm")
-            img = Image.open(io.BytesIO(img_data))
+        Returns:
+            PIL.Image: RGB (or grayscale) image sharing the pixmap's pixel data
+        """
+        mode = PIXMAP_MODES[pix.n]
+        
+        # Raw samples go straight into PIL, no PNG/PPM encode and decode
+        return Image.frombuffer(
+            mode, (pix.width, pix.height), pix.samples_mv, 'raw', mode, pix.stride, 1
+        )
+    
+    def pixmap_array(self, pix):
+        """
+        View a rendered pixmap's samples as a numpy array, without copying.
+        
+        Args:
+            pix (fitz.Pixmap): Rendered page
             
-            images.append(img)
+        Returns:
+            numpy.ndarray: uint8 array of shape (height, width) for gray
+                pixmaps, (height, width, channels) otherwise
+        """
+        arr = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+        arr = arr.reshape(pix.height, pix.stride)[:, :pix.width * pix.n]
         
-        doc.close()
-        print(f"Converted {len(images)} pages to images")
-        return images
+        if pix.n == 1:
+            return arr
+        return arr.reshape(pix.height, pix.width, pix.n)
     
-    def invert_image_colors(self, image):
+    def scratch_buffer(self, shape):
         """
-        Perform true color inversion on an image.
+        Get the reusable page buffer, reallocating only if the shape changes.
         
         Args:
-            image (PIL.Image): Input image
+            shape (tuple): Required array shape
+            
+        Returns:
+            numpy.ndarray: Uninitialized uint8 array of the given shape
+        """
+        if self._scratch is None or self._scratch.shape != shape:
+            self._scratch = np.empty(shape, dtype=np.uint8)
+        return self._scratch
+    
+    def invert_image_colors(self, pix):
+        """
+        Perform true color inversion on a rendered page.
+        
+        Inverting a uint8 pixel is the same as a bitwise NOT, so this works
+        on the pixmap's raw bytes instead of going through PIL. The result is
+        written to the scratch buffer, so the returned image is only valid
+        until the next page is inverted.
+        
+        Args:
+            pix (fitz.Pixmap): Rendered page
             
         Returns:
             PIL.Image: Image with inverted colors
         """
-        # Convert to RGB if not already
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # One pass from the pixmap's samples into the reused buffer
+        src = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+        src = src.reshape(pix.height, pix.stride)
+        arr = self.scratch_buffer(src.shape)
         
-        # Method 1: Using PIL's ImageOps.invert
-        # This is the simplest and most reliable method
-        inverted = ImageOps.invert(image)
+        if _invert_lib is not None:
+            _invert_lib.invert_copy(src.ctypes.data, arr.ctypes.data, arr.nbytes)
+        else:
+            np.invert(src, out=arr)
         
-        return inverted
+        mode = PIXMAP_MODES[pix.n]
+        return Image.frombuffer(
+            mode, (pix.width, pix.height), arr, 'raw', mode, pix.stride, 1
+        )
     
-    def advanced_color_inversion(self, image):
+    def advanced_color_inversion(self, image, out=None):
         """
         Advanced color inversion with fine-tuned adjustments.
         
@@ -122,38 +361,43 @@ class TruePDFColorInverter:
         and can handle edge cases better.
         
         Args:
-            image (PIL.Image): Input image
+            image (PIL.Image or numpy.ndarray): Input image
+            out (numpy.ndarray): Optional uint8 buffer with the image's shape
+                to write the result into (only used with Numba)
             
         Returns:
             PIL.Image: Image with advanced color inversion
         """
-        # Convert to numpy array for pixel manipulation
-        img_array = np.array(image)
+        img_array = np.asarray(image)
         
-        # Invert colors: 255 - original_value
-        inverted_array = 255 - img_array
+        kernel = None
+        if img_array.ndim == 3 and img_array.shape[2] == 3:
+            kernel = _presentation_kernel()
         
-        # Optional: Adjust contrast or brightness if needed
-        # This can help with readability in some cases
+        if kernel is not None:
+            if out is None:
+                out = np.empty_like(img_array)
+            kernel(img_array, out)
+            return Image.fromarray(out)
         
         # For very light grays, make them darker
         # For very dark grays, make them lighter
-        mask_light = (inverted_array > 200).all(axis=2)
-        mask_dark = (inverted_array < 55).all(axis=2)
-        
-        # Adjust light areas to be darker
-        inverted_array[mask_light] = inverted_array[mask_light] * 0.8
-        
-        # Adjust very dark areas to be slightly lighter for readability
-        inverted_array[mask_dark] = inverted_array[mask_dark] + 30
-        
-        # Ensure values stay in valid range
-        inverted_array = np.clip(inverted_array, 0, 255)
+        # A pixel is light after inversion when every channel is > 200, i.e.
+        # every original channel is < 55; dark pixels are the mirror case
+        if img_array.ndim == 3:
+            darkest, lightest = img_array.max(axis=2), img_array.min(axis=2)
+        else:
+            darkest = lightest = img_array
+        # The boolean mask doubles as the row index, viewed as uint8 in place
+        row = np.less(darkest, 55).view(np.uint8)
+        row[lightest > 200] = 2
         
-        # Convert back to PIL Image
-        inverted_image = Image.fromarray(inverted_array.astype('uint8'))
+        # Invert and adjust in one lookup, picking the table row per pixel
+        if img_array.ndim == 3:
+            row = row[..., None]
+        inverted_array = _LUT_PRESENTATION[row, img_array]
         
-        return inverted_image
+        return Image.fromarray(inverted_array)
     
     def printing_color_inversion(self, image):
         """
@@ -168,57 +412,103 @@ class TruePDFColorInverter:
         Returns:
             PIL.Image: Image with printing-optimized color inversion
         """
-        # Convert to numpy array for pixel manipulation
-        img_array = np.array(image)
-        
-        # Invert colors: 255 - original_value
-        inverted_array = 255 - img_array
-        
-        # For printing mode, we want a lighter dark mode
-        # Reduce the intensity of the inversion to make it more print-friendly
-        inverted_array = inverted_array * 0.7  # Make it 70% of full inversion
+        # 70% of a full inversion with some white added back, as a lookup
+        # applied in C by PIL, one table per band
+        return image.point(_LUT_PRINTING * len(image.getbands()))
+    
+    def invert_page(self, pix, mode="reading"):
+        """
+        Invert a rendered page using the method for the given mode.
         
-        # Add some white back to make it lighter
-        inverted_array = inverted_array + (255 * 0.3)
+        Args:
+            pix (fitz.Pixmap): Rendered page
+            mode (str): Processing mode - "reading", "printing", or "presentation"
+            
+        Returns:
+            PIL.Image: Image with inverted colors
+        """
+        # Apply different inversion methods based on mode
+        if mode == "presentation":
+            src = self.pixmap_array(pix)
+            return self.advanced_color_inversion(src, out=self.scratch_buffer(src.shape))
+        elif mode == "printing":
+            return self.printing_color_inversion(self.pixmap_to_image(pix))
+        else:  # reading mode (default)
+            return self.invert_image_colors(pix)
+    
+    def images_to_pdf(self, pages, output, mode="reading"):
+        """
+        Create a PDF from inverted pages, writing each page as it arrives.
         
-        # Ensure values stay in valid range
-        inverted_array = np.clip(inverted_array, 0, 255)
+        Each page is embedded as a JPEG stream, which PyMuPDF inserts as-is
+        instead of re-encoding it.
         
-        # Convert back to PIL Image
-        inverted_image = Image.fromarray(inverted_array.astype('uint8'))
+        Args:
+            pages (iterable): (pixel_bytes, image_mode, width, height) tuples,
+                one per page
+            output (str): Path for the output PDF
+            mode (str): Processing mode, used to pick the JPEG quality
+            
+        Returns:
+            int: Number of pages written
+        """
+        quality = JPEG_QUALITY.get(mode, JPEG_QUALITY["reading"])
+        out = fitz.open()
+        try:
+            for page_num, (data, img_mode, width, height) in enumerate(pages):
+                # Pages are rendered lazily, so announce this step only once
+                # the rendering messages for the first page are out
+                if page_num == 0:
+                    print("Creating PDF from inverted images...")
+                print(f"Processing page {page_num + 1}")
+                
+                img = Image.frombuffer(img_mode, (width, height), data, 'raw', img_mode, 0, 1)
+                buf = io.BytesIO()
+                img.save(buf, 'JPEG', quality=quality, optimize=True)
+                
+                # Keep the original page size: pixels / DPI * 72 points
+                page = out.new_page(
+                    width=width * 72 / self.render_dpi,
+                    height=height * 72 / self.render_dpi,
+                )
+                page.insert_image(page.rect, stream=buf.getvalue())
+            
+            page_count = len(out)
+            if not page_count:
+                raise ValueError("No images to convert to PDF")
+            
+            out.save(output, deflate=True, garbage=4)
+        finally:
+            out.close()
         
-        return inverted_image
+        print(f"PDF created successfully: {output}")
+        return page_count
     
-    def images_to_pdf(self, images, output_path):
+    def invert_document(self, doc, source, output, mode="reading"):
         """
-        Create a PDF from a list of images.
+        Invert an open document and write the result.
         
         Args:
-            images (list): List of PIL Image objects
-            output_path (str): Path for the output PDF file
+            doc (fitz.Document): Open input document
+            source (str): Path to the input PDF, for worker processes to open
+            output (str): Path for the output PDF
+            mode (str): Processing mode - "reading", "printing", or "presentation"
+            
+        Returns:
+            int: Number of pages written
         """
-        print(f"Creating PDF from {len(images)} inverted images...")
-        
-        if not images:
-            raise ValueError("No images to convert to PDF")
-        
-        # Convert all images to RGB mode
-        rgb_images = []
-        for img in images:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            rgb_images.append(img)
-        
-        # Save as PDF
-        rgb_images[0].save(
-            output_path,
-            save_all=True,
-            append_images=rgb_images[1:],
-            format='PDF',
-            resolution=self.dpi
-        )
-        
-        print(f"PDF created successfully: {output_path}")
+        if not len(doc):
+            raise ValueError("No pages found in PDF or conversion failed")
+        
+        # Adjust DPI up front so long or large-format documents
+        # stay within the rendering budget
+        self.render_dpi = self.adaptive_dpi(doc)
+        if self.render_dpi < self.dpi:
+            print(f"Lowering DPI to {self.render_dpi} to stay within the rendering budget")
+        
+        # Steps 1-3: Stream inverted pages straight into the new PDF
+        pages = self.iter_inverted_pages(doc, source, mode)
+        return self.images_to_pdf(pages, output, mode)
     
     def process_pdf(self, input_path, output_path, mode="reading"):
         """
@@ -236,38 +526,10 @@ class TruePDFColorInverter:
             print(f"Starting true color inversion for: {input_path}")
             print(f"Output will be saved to: {output_path}")
             
-            # Check file size and adjust DPI for large files
-            file_size = os.path.getsize(input_path)
-            if file_size > 10 * 1024 * 1024:  # 10MB
-                print(f"Large file detected ({file_size / (1024*1024):.1f}MB), optimizing DPI...")
-                self.dpi = 200  # Reduce DPI for large files
-                print(f"Reduced DPI to {self.dpi} for better performance")
-            
-            # Step 1: Convert PDF to images
-            images = self.pdf_to_images(input_path)
+            with fitz.open(input_path) as doc:
+                written = self.invert_document(doc, input_path, output_path, mode)
             
-            if not images:
-                raise ValueError("No pages found in PDF or conversion failed")
-            
-            # Step 2: Invert colors in each image
-            print("Inverting colors...")
-            inverted_images = []
-            
-            for i, img in enumerate(images):
-                print(f"Inverting colors for page {i + 1}/{len(images)}")
-                
-                # Apply different inversion methods based on mode
-                if mode == "presentation":
-                    inverted_img = self.advanced_color_inversion(img)
-                elif mode == "printing":
-                    inverted_img = self.printing_color_inversion(img)
-                else:  # reading mode (default)
-                    inverted_img = self.invert_image_colors(img)
-                
-                inverted_images.append(inverted_img)
-            
-            # Step 3: Create new PDF from inverted images
-            self.images_to_pdf(inverted_images, output_path)
+            print(f"Converted {written} pages to images")
             
             print("SUCCESS: Color inversion completed successfully!")
             return True
@@ -275,19 +537,61 @@ class TruePDFColorInverter:
         except Exception as e:
             print(f"ERROR: Error during processing: {str(e)}")
             return False
+
+
+def _available_cpus():
+    """
+    Count the CPUs this process may run on.
+    
+    Honors the CPU affinity mask where the platform exposes it, so
+    containers pinned to a few cores don't start a worker per host core.
+    
+    Returns:
+        int: Number of usable CPUs
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Per-process state of pool workers, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(source, dpi):
+    """
+    Open the input document once per worker process.
+    
+    Args:
+        source (str): Path to the input PDF
+        dpi (int): Resolution to render pages at
+    """
+    inverter = TruePDFColorInverter(dpi=dpi)
+    
+    _worker["inverter"] = inverter
+    _worker["doc"] = fitz.open(source)
+
+
+def _render_and_invert(page_idx, mode):
+    """
+    Render and invert a single page; runs inside a worker process.
+    
+    The result is returned as raw pixel bytes rather than a PIL image so it is
+    cheap to send back to the parent process.
+    
+    Args:
+        page_idx (int): Zero-based index of the page to process
+        mode (str): Processing mode - "reading", "printing", or "presentation"
         
-        finally:
-            # Clean up temporary files if any
-            self.cleanup_temp_files()
+    Returns:
+        tuple: (pixel_bytes, image_mode, width, height)
+    """
+    inverter = _worker["inverter"]
+    page = _worker["doc"].load_page(page_idx)
+    pix = inverter.render_page(page)
     
-    def cleanup_temp_files(self):
-        """Clean up any temporary files created during processing."""
-        try:
-            if self.temp_dir.exists():
-                for file in self.temp_dir.glob("*"):
-                    file.unlink()
-        except Exception as e:
-            print(f"Warning: Could not clean up temp files: {e}")
+    inverted = inverter.invert_page(pix, mode)
+    return inverted.tobytes(), inverted.mode, inverted.width, inverted.height
 
 
 def main():
@@ -355,6 +659,4 @@ def main():
 
 
 if __name__ == "__main__":
-    # Add missing import for io
-    import io
     main()
\ No newline at end of file